@@ -3,6 +3,8 @@ import numpy as np
 
 class _AbstractMicrostructureBasis(object):
 
+    _discretizes_in_place = True
+
     def __init__(self, n_states=2, domain=None):
         """
         Instantiate a `Basis`
@@ -26,9 +28,16 @@ class _AbstractMicrostructureBasis(object):
         if (np.min(X) < self.domain[0]) or (np.max(X) > self.domain[1]):
             raise RuntimeError("X must be within the specified domain")
 
-    def discretize(self, X):
+    def discretize(self, X, out=None):
         raise NotImplementedError
 
+    def _discretized_shape(self, X):
+        """
+        Shape of the discretized microstructure function for a given
+        microstructure X.
+        """
+        return X.shape + (len(self.n_states),)
+
     def _check_shape(self, X_shape, y_shape):
         if not len(y_shape) > 1:
             raise RuntimeError("The shape of y is incorrect.")
@@ -42,13 +51,15 @@ class _AbstractMicrostructureBasis(object):
         """
         return X.shape
 
-    def _select_slice(self, ijk, s0):
+    def _column_mask(self, shape):
         """
         Helper method used to calibrate influence coefficients from in
         mks_localization_model to account for redundancies from linearly
-        dependent local states.
+        dependent local states. Returns a boolean array of shape
+        `shape + (n_states,)` marking the local states used at each
+        frequency.
         """
-        return s0
+        return np.ones(tuple(shape) + (len(self.n_states),), dtype=bool)
 
     def _reshape_feature(self, X, size):
         """
@@ -62,9 +73,15 @@ class _AbstractMicrostructureBasis(object):
             size: the new size of the array
 
         Returns:
-            microstructure with shape (n_samples, size)
+            microstructure with shape (n_samples, size), a view of X when
+            possible
+
+        >>> X = np.arange(12).reshape((2, 6))
+        >>> basis = _AbstractMicrostructureBasis()
+        >>> assert basis._reshape_feature(X, (6,)) is X
+        >>> assert np.shares_memory(basis._reshape_feature(X, [2, 3]), X)
         """
-        return X.reshape((X.shape[0],) + size)
+        return self._reshape(X, (X.shape[0],) + tuple(size))
 
     def _reshape_localization_data(self, y, size):
         """
@@ -78,9 +95,19 @@ class _AbstractMicrostructureBasis(object):
             size: the new size of the array
 
         Returns:
-            Localization fields with shape (n_samples, size)
+            Localization fields with shape (n_samples, size), a view of y
+            when possible
+        """
+        return self._reshape(y, (y.shape[0],) + tuple(size))
+
+    @staticmethod
+    def _reshape(X, shape):
+        """
+        Reshape X without a copy unless the strides of X require one.
         """
-        return y.reshape((y.shape[0],) + size)
+        if X.shape == shape:
+            return X
+        return X.reshape(shape)
 
     def _select_axes(self, X):
         self._axes = np.arange(X.ndim - 1) + 1
@@ -29,9 +29,26 @@ If `PYMKS_USE_FFTW` is set to a negative value then Numpy's fft module
 is used. If `PYMKS_USE_FFTW` is unavailable and `use-fftw` is set to
 false or is unavailable, then Numpy's fft module is used.
 
+When PyFFTW is used, the plans are made with `FFTW_ESTIMATE` and
+transform the data in place when it is aligned, so that no copies are
+made. Set `PYMKS_FFTW_PLANNER_EFFORT` to another planner effort, for
+example `FFTW_MEASURE`, to have FFTW measure the plans. FFTW keeps the
+measurements as wisdom so a shape is only measured once. The wisdom
+is saved at exit and loaded on import so that the measurements are
+also reused between sessions. The wisdom file is
+`~/.pymks_wisdom_<machine>_<number of CPUs>` unless
+`PYMKS_FFTW_WISDOM` is set to another path.
+
+Arrays that are not Numpy arrays, for example CuPy arrays, are always
+passed to Numpy's fft module, which defers to the array's own fft
+implementation.
+
 """
+import atexit
 import configparser
+import json
 import os
+import platform
 
 import numpy.fft as numpy_fft
 import numpy as np
@@ -118,12 +135,85 @@ def choose_fftmodule():
 
 FFTMODULE = choose_fftmodule()
 
-def arg_wrap(fft_func, **extra_args):
+def wisdom_path():
+    """Path of the file used to keep the FFTW wisdom between sessions.
+
+    Wisdom is only valid on the hardware it was measured on, so the
+    default file name includes the machine type and the number of CPUs.
+
+    Returns:
+      the value of `PYMKS_FFTW_WISDOM` if set, otherwise a file in the
+      home directory
+    """
+    return os.environ.get(
+        'PYMKS_FFTW_WISDOM',
+        os.path.join(os.path.expanduser('~'), '.pymks_wisdom_{0}_{1}'.format(
+            platform.machine(), os.cpu_count()
+        ))
+    )
+
+def load_wisdom(path):
+    """Import FFTW wisdom saved by `save_wisdom`.
+
+    Missing or unreadable files are ignored.
+
+    Args:
+      path: the wisdom file
+    """
+    import pyfftw
+    try:
+        with open(path) as file:
+            wisdom = json.load(file)
+        pyfftw.import_wisdom(tuple(item.encode() for item in wisdom))
+    except (OSError, ValueError, TypeError, AttributeError):
+        pass
+
+def save_wisdom(path):
+    """Export the FFTW wisdom to a file.
+
+    The file is replaced atomically so that concurrent sessions do not
+    corrupt it. Failures to write the file are ignored.
+
+    Args:
+      path: the wisdom file
+    """
+    import pyfftw
+    wisdom = [item.decode() for item in pyfftw.export_wisdom()]
+    tmp_path = '{0}.{1}'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as file:
+            json.dump(wisdom, file)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+if FFTMODULE.__name__.split('.')[0] == 'pyfftw':
+    load_wisdom(wisdom_path())
+    atexit.register(save_wisdom, wisdom_path())
+
+def empty_aligned(shape, dtype=float):
+    """Allocate an empty array suitably aligned for the fft suite.
+
+    Args:
+      shape: the shape of the array
+      dtype: the type of the array
+
+    Returns:
+      an aligned array with PyFFTW, otherwise `numpy.empty`
+    """
+    if FFTMODULE.__name__.split('.')[0] == 'pyfftw':
+        import pyfftw
+        return pyfftw.empty_aligned(shape, dtype=dtype)
+    else:
+        return np.empty(shape, dtype=dtype)
+
+def arg_wrap(fft_func, destroys_input=False):
     """Decorator to add kwargs based on fft suite.
 
     Args:
       fft_func: the fft function to arg wrap
-      extra_args: extra args to add to the PyFFTW call
+      destroys_input: whether the PyFFTW transform overwrites its input
 
     Returns:
       the wrapped function
@@ -135,25 +225,21 @@ def arg_wrap(fft_func, **extra_args):
 
         Args:
           data: data to transform
-          fftmodule: either numpy.fft or pyfftw.builders
           threads: the threads argument
-          extra_args: extra args to add
 
         Returns:
           the transformed data
         """
-        if using_fftw:
-            kwargs.update(dict(planner_effort='FFTW_ESTIMATE',
-                               avoid_copy=False))
-            kwargs.update(extra_args)
-            return fft_func(np.ascontiguousarray(data), axes=axes, **kwargs)()
+        if using_fftw and isinstance(data, np.ndarray):
+            return execute_fftw(fft_func, data, axes,
+                                destroys_input=destroys_input, **kwargs)
         else:
             kwargs.pop('threads', None)
-            return fft_func(data, axes=axes, **kwargs)
+            return fft_func(data, axes=axes, fftmodule=numpy_fft, **kwargs)
     return wrapper
 
-def arg_wrap_overwrite(fft_func):
-    """Add the overwrite_input=True argument to arg_wrap
+def arg_wrap_destroy(fft_func):
+    """Add the destroys_input=True argument to arg_wrap
 
     Args:
       fft_func: the fft function to arg wrap
@@ -161,57 +247,98 @@ def arg_wrap_overwrite(fft_func):
     Returns:
       the wrapped function
     """
-    return arg_wrap(fft_func, overwrite_input=True)
+    return arg_wrap(fft_func, destroys_input=True)
+
+def execute_fftw(fft_func, data, axes, destroys_input=False, **kwargs):
+    """Plan and execute a PyFFTW transform without changing the data.
+
+    The plan uses the data as its input array when the data is aligned,
+    contiguous and of a type FFTW transforms, and the planner effort
+    does not overwrite the input while planning. Otherwise PyFFTW
+    copies the data. Transforms that overwrite their input are given a
+    copy.
+
+    Args:
+      fft_func: the pyfftw.builders function
+      data: data to transform
+      axes: the axes over which to perform the transform
+      destroys_input: whether the transform overwrites its input
+      kwargs: extra args to pass to the PyFFTW builder
+
+    Returns:
+      the transformed data
+    """
+    import pyfftw
+    planner_effort = os.environ.get('PYMKS_FFTW_PLANNER_EFFORT',
+                                    'FFTW_ESTIMATE')
+    if destroys_input:
+        scratch = empty_aligned(data.shape, dtype=data.dtype)
+        scratch[...] = data
+        data = scratch
+    if planner_effort == 'FFTW_ESTIMATE' and data.flags.c_contiguous \
+       and pyfftw.is_byte_aligned(data):
+        try:
+            return fft_func(data, axes=axes, planner_effort=planner_effort,
+                            avoid_copy=True, **kwargs)()
+        except ValueError:
+            ## the builder had to convert the data to another type
+            pass
+    return fft_func(data, axes=axes, planner_effort=planner_effort,
+                    avoid_copy=False, **kwargs)()
 
-@arg_wrap_overwrite
-def rfftn(data, axes=None, **kwargs):
+@arg_wrap
+def rfftn(data, axes=None, fftmodule=FFTMODULE, **kwargs):
     """Real Fourier transform wrapper
 
     Args:
       X: microstructure
       axes: the axes over which to perform the transform
+      fftmodule: either numpy.fft or pyfftw.builders
 
     Returns:
       the transformation
     """
-    return FFTMODULE.rfftn(data, axes=axes, **kwargs)
+    return fftmodule.rfftn(data, axes=axes, **kwargs)
 
-@arg_wrap
-def irfftn(data, axes=None, axes_shape=None, **kwargs):
+@arg_wrap_destroy
+def irfftn(data, axes=None, axes_shape=None, fftmodule=FFTMODULE, **kwargs):
     """Inverse real Fourier transform wrapper
 
     Args:
       data: data to transform
       axes: the axes over which to perform the transform
       axes_shape: the axes shape
+      fftmodule: either numpy.fft or pyfftw.builders
 
     Returns:
       the transformation
     """
-    return FFTMODULE.irfftn(data, axes=axes, s=axes_shape, **kwargs)
+    return fftmodule.irfftn(data, axes=axes, s=axes_shape, **kwargs)
 
-@arg_wrap_overwrite
-def fftn(data, axes=None, **kwargs):
+@arg_wrap
+def fftn(data, axes=None, fftmodule=FFTMODULE, **kwargs):
     """Fourier transform wrapper
 
     Args:
       data: microstructure
       axes: the axes over which to perform the transform
+      fftmodule: either numpy.fft or pyfftw.builders
 
     Returns:
       the transformation
     """
-    return FFTMODULE.fftn(data, axes=axes, **kwargs)
+    return fftmodule.fftn(data, axes=axes, **kwargs)
 
-@arg_wrap_overwrite
-def ifftn(data, axes=None, **kwargs):
+@arg_wrap
+def ifftn(data, axes=None, fftmodule=FFTMODULE, **kwargs):
     """Inverse Fourier transform wrapper
 
     Args:
       data: microstructure
       axes: the axes over which to perform the transform
+      fftmodule: either numpy.fft or pyfftw.builders
 
     Returns:
       the transformation
     """
-    return FFTMODULE.ifftn(data, axes=axes, **kwargs)
+    return fftmodule.ifftn(data, axes=axes, **kwargs)
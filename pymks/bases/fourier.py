@@ -64,7 +64,7 @@ class FourierBasis(_ImagFFTBasis):
             domain = [0, 2. * np.pi]
         super(FourierBasis, self).__init__(n_states=n_states, domain=domain)
 
-    def discretize(self, X):
+    def discretize(self, X, out=None):
         """
         Discretize `X`.
 
@@ -72,6 +72,8 @@ class FourierBasis(_ImagFFTBasis):
             X (ND array): The microstructure, an `(n_samples, n_x, ...)`
                 shaped array where `n_samples` is the number of samples and
                 `n_x` is the spatial discretization.
+            out (ND array, optional): Complex array of shape `(n_samples, n_x,
+                ..., n_states)` to write the result into.
         Returns:
             Float valued field of Fourier series coefficients in the following
             order 0, 1, ,-1, 2, -2, with shaped `(n_samples, n_x, ...,
@@ -90,7 +92,5 @@ class FourierBasis(_ImagFFTBasis):
         self._select_axes(X)
         X_scaled = 2. * np.pi * ((X.astype(float) - self.domain[0]) /
                                  (self.domain[1] - self.domain[0]))
-        nones = ([None for i in X.shape])
-        X_states = np.zeros(X_scaled.shape + (len(self.n_states),))
-        X_states[..., :] = np.array(self.n_states)[nones]
-        return np.exp(X_scaled[..., None] * X_states * 1j)
+        return np.exp(X_scaled[..., None] * (np.array(self.n_states) * 1j),
+                      out=out)
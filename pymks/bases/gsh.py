@@ -53,6 +53,10 @@ class GSHBasis(_ImagFFTBasis):
     RuntimeError: invalid crystal symmetry
     """
 
+    ## the GSH functions allocate their result so they cannot write
+    ## into a given array
+    _discretizes_in_place = False
+
     def __init__(self, n_states=15, domain=None):
         """
         Instantiate a `Basis`
@@ -124,7 +128,7 @@ class GSHBasis(_ImagFFTBasis):
             _shape = (X.shape[0],) + (X.shape[1] / 3,)
         return _shape
 
-    def discretize(self, X):
+    def discretize(self, X, out=None):
         """
         Discretize `X`.
 
@@ -133,6 +137,8 @@ class GSHBasis(_ImagFFTBasis):
                 shaped array where `n_samples` is the number of samples,
                 `n_x` is the spatial discretization and the last dimension
                 contains the Bunge Euler angles in radians.
+            out (ND array, optional): Complex array of shape `(n_samples, n_x,
+                ..., n_states)` to write the result into.
         Returns:
             Float valued field of of Generalized Spherical Harmonics
             coefficients.
@@ -151,7 +157,17 @@ class GSHBasis(_ImagFFTBasis):
         """
         self.check(X)
         self._select_axes(X[..., 0])
-        return self._gsh_eval(X)
+        if out is None:
+            return self._gsh_eval(X)
+        out[...] = self._gsh_eval(X)
+        return out
+
+    def _discretized_shape(self, X):
+        """
+        Shape of the discretized microstructure function for a given
+        microstructure X.
+        """
+        return X.shape[:-1] + (len(self.n_states),)
 
     def _reshape_feature(self, X, size):
         """
@@ -167,8 +183,8 @@ class GSHBasis(_ImagFFTBasis):
         Returns:
             microstructure with shape (n_samples, size)
         """
-        _shape = (X.shape[0],) + size + (3,)
-        return X.reshape(_shape)
+        _shape = (X.shape[0],) + tuple(size) + (3,)
+        return self._reshape(X, _shape)
 
     def _gsh_basis_info(self):
         """
@@ -8,6 +8,8 @@ class _ImagFFTBasis(_AbstractMicrostructureBasis):
     the appropriate fft module depending on whether or not pyfftw is installed.
     """
 
+    _dtype = complex
+
     def _fftn(self, X):
         """Standard FFT algorithm
 
@@ -48,7 +48,7 @@ class LegendreBasis(_RealFFTBasis):
 
     """
 
-    def discretize(self, X):
+    def discretize(self, X, out=None):
         """
         Discretize `X`.
 
@@ -56,6 +56,8 @@ class LegendreBasis(_RealFFTBasis):
             X (ND array): The microstructure, an `(n_samples, n_x, ...)`
                 shaped array where `n_samples` is the number of samples and
                 `n_x` is the spatial discretization.
+            out (ND array, optional): Array of shape `(n_samples, n_x, ...,
+                n_states)` to write the result into.
         Returns:
             Float valued field of of Legendre polynomial coefficients.
 
@@ -75,5 +77,8 @@ class LegendreBasis(_RealFFTBasis):
         X_scaled = (2. * X - self.domain[0] - self.domain[1]) /\
                    (self.domain[1] - self.domain[0])
         norm = (2. * np.array(self.n_states) + 1) / 2.
-        X_Legendre = (leg.legval(X_scaled, np.eye(len(self.n_states)) * norm))
-        return np.rollaxis(X_Legendre, 0, len(X_Legendre.shape))
+        if out is None:
+            out = np.empty(self._discretized_shape(X))
+        for i, coeff in enumerate((np.eye(len(self.n_states)) * norm).T):
+            out[..., i] = leg.legval(X_scaled, coeff)
+        return out
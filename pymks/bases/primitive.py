@@ -109,19 +109,23 @@ class PrimitiveBasis(_RealFFTBasis):
 
     """
 
-    def _select_slice(self, ijk, s0):
+    def _column_mask(self, shape):
         """
         Helper method used to calibrate influence coefficients from in
         mks_localization_model to account for redundancies from linearly
-        dependent local states.
+        dependent local states. The local states sum to one, so the last
+        local state is dropped at every frequency but the first.
+
+        >>> PrimitiveBasis(3)._column_mask((2,))
+        array([[ True,  True,  True],
+               [ True,  True, False]])
         """
-        if np.all(np.array(ijk) == 0):
-            s1 = s0
-        else:
-            s1 = (slice(-1),)
-        return s1
+        mask = super(PrimitiveBasis, self)._column_mask(shape)
+        mask[..., -1] = False
+        mask[(0,) * len(shape)] = True
+        return mask
 
-    def discretize(self, X):
+    def discretize(self, X, out=None):
         """
         Discretize `X`.
 
@@ -129,11 +133,22 @@ class PrimitiveBasis(_RealFFTBasis):
             X (ND array): The microstructure, an `(n_samples, n_x, ...)`
                 shaped array where `n_samples` is the number of samples and
                 `n_x` is thes patial discretization.
+            out (ND array, optional): Array of shape `(n_samples, n_x, ...,
+                n_states)` to write the result into.
         Returns:
             Float valued field of local states between 0 and 1.
+
+        >>> X = np.array([[0, 0.25, 1]])
+        >>> out = np.empty((1, 3, 2))
+        >>> X_ = PrimitiveBasis(2, [0, 1]).discretize(X, out=out)
+        >>> assert X_ is out
+        >>> assert np.allclose(out, [[[1, 0], [0.75, 0.25], [0, 1]]])
         """
         self.check(X)
         self._select_axes(X)
         H = np.linspace(self.domain[0], self.domain[1], max(self.n_states) + 1)
-        X_ = np.maximum(1 - (abs(X[..., None] - H)) / (H[1] - H[0]), 0)
-        return X_[..., list(self.n_states)]
+        X_ = np.subtract(X[..., None], H[list(self.n_states)], out=out)
+        np.abs(X_, out=X_)
+        X_ /= -(H[1] - H[0])
+        X_ += 1
+        return np.maximum(X_, 0, out=X_)
@@ -8,6 +8,8 @@ class _RealFFTBasis(_AbstractMicrostructureBasis):
     the appropriate fft module depending on whether or not pyfftw is installed.
     """
 
+    _dtype = float
+
     def _fftn(self, X):
         """Real rFFT algorithm
 
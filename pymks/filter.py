@@ -1,5 +1,111 @@
+from functools import lru_cache
+
 import numpy as np
 
+from .lstsq import get_array_module, numba_threads
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+
+def _contract_loop(FX, Fkernel, Fy):
+    """Multiply and sum over the local states one sample at a time.
+    """
+    n_samples, n_freq, n_states = FX.shape
+    for i in numba.prange(n_samples):  # pylint: disable=not-an-iterable
+        for j in range(n_freq):
+            Fy_ = 0j
+            for k in range(n_states):
+                Fy_ += FX[i, j, k] * Fkernel[j, k]
+            Fy[i, j] = Fy_
+
+
+if numba is not None:
+    _contract_loop = numba.njit(parallel=True, cache=True)(_contract_loop)
+
+
+_CONTRACT_SOURCE = r'''
+#include <cupy/complex.cuh>
+extern "C" __global__
+void contract(const COMPLEX* FX, const COMPLEX* Fkernel, COMPLEX* Fy,
+              long long n_samples, long long n_freq, int n_states) {
+    long long i = (long long)blockDim.x * blockIdx.x + threadIdx.x;
+    if (i < n_samples * n_freq) {
+        long long j = i % n_freq;
+        COMPLEX Fy_(0, 0);
+        for (int k = 0; k < n_states; k++) {
+            Fy_ += FX[i * n_states + k] * Fkernel[j * n_states + k];
+        }
+        Fy[i] = Fy_;
+    }
+}
+'''
+
+
+@lru_cache(maxsize=None)
+def _contract_kernel(complex_type):
+    """Compile the CUDA contraction kernel for a complex type.
+    """
+    import cupy
+    return cupy.RawKernel(_CONTRACT_SOURCE.replace('COMPLEX', complex_type),
+                          'contract')
+
+
+def contract(FX, Fkernel, n_jobs=1):
+    """Multiply by the kernel and sum over the local states.
+
+    This is `np.sum(FX * Fkernel, axis=-1)` without the intermediate
+    array the size of `FX`. A compiled loop is used with Numba and a
+    CUDA kernel with CuPy arrays, otherwise, or if `Fkernel` has more
+    than one sample, `np.einsum`.
+
+    Args:
+      FX: array of shape `(n_samples, n_x, ..., n_states)`
+      Fkernel: array of shape `(1, n_x, ..., n_states)` or
+        `(n_samples, n_x, ..., n_states)`
+      n_jobs: the number of threads used by the compiled loop
+
+    Returns:
+      array of shape `(n_samples, n_x, ...)`
+
+    >>> np.random.seed(0)
+    >>> FX = np.random.random((2, 3, 4, 2)) + 1j
+    >>> Fkernel = np.random.random((1, 3, 4, 2)) - 1j
+    >>> assert np.allclose(contract(FX, Fkernel),
+    ...                    np.sum(FX * Fkernel, axis=-1))
+    >>> assert np.allclose(contract(FX, FX), np.sum(FX * FX, axis=-1))
+    """
+    xp = get_array_module(FX)
+    dtype = np.result_type(FX.dtype, Fkernel.dtype)
+    shape = (len(FX), -1, FX.shape[-1])
+    if len(Fkernel) != 1:
+        Fy = xp.einsum('...k,...k->...', FX, Fkernel)
+    elif xp is not np:
+        FX_ = xp.ascontiguousarray(FX.reshape(shape), dtype=dtype)
+        Fkernel_ = xp.ascontiguousarray(Fkernel.reshape(shape[1:]),
+                                        dtype=dtype)
+        Fy = xp.empty(FX_.shape[:-1], dtype=dtype)
+        complex_type = 'complex<float>'
+        if dtype == np.complex128:
+            complex_type = 'complex<double>'
+        threads = 256
+        _contract_kernel(complex_type)(
+            ((Fy.size + threads - 1) // threads,), (threads,),
+            (FX_, Fkernel_, Fy, np.int64(Fy.shape[0]), np.int64(Fy.shape[1]),
+             np.int32(FX_.shape[-1]))
+        )
+    elif numba is not None:
+        Fy = np.empty(FX.shape[:-1], dtype=dtype)
+        with numba_threads(n_jobs):
+            _contract_loop(np.ascontiguousarray(FX).reshape(shape),
+                           np.ascontiguousarray(Fkernel).reshape(shape[1:]),
+                           Fy.reshape(shape[:-1]))
+    else:
+        Fy = np.einsum('...k,...k->...', FX, Fkernel)
+    return Fy.reshape(FX.shape[:-1])
+
 
 class Filter(object):
     """
@@ -50,12 +156,13 @@ class Filter(object):
         return self.basis._fftn(np.fft.ifftshift(kernel,
                                 axes=self.basis._axes))
 
-    def convolve(self, X):
+    def convolve(self, X, n_jobs=1):
         """
         Convolve X with a kernel in frequency space.
 
         Args:
           X: array to be convolved
+          n_jobs: the number of threads used to multiply by the kernel
 
         Returns:
           convolution of X with the kernel
@@ -63,12 +170,9 @@ class Filter(object):
         FX = self.basis._fftn(X)
         if FX.shape[1:] != self._Fkernel.shape[1:]:
             raise RuntimeError("Dimensions of X are incorrect.")
-        Fy = self._sum(FX * self._Fkernel)
+        Fy = contract(FX, self._Fkernel, n_jobs=n_jobs)
         return self.basis._ifftn(Fy)
 
-    def _sum(self, Fy):
-        return np.sum(Fy, axis=-1)
-
     def resize(self, size):
         """
         Changes the size of the kernel to size.
@@ -172,9 +276,6 @@ class Correlation(Filter):
         if X.shape[1:-1] < self.basis._axes_shape:
             X = self._zero_pad(X, self.basis._axes_shape)
         FX = self.basis._fftn(X)
-        Fy = self._sum(FX * self._Fkernel)
+        Fy = FX * self._Fkernel
         correlation = self.basis._ifftn(Fy)
         return np.fft.fftshift(correlation, axes=self.basis._axes)
-
-    def _sum(self, Fy):
-        return Fy
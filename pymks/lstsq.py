@@ -0,0 +1,454 @@
+"""Least squares solvers used to calibrate the MKS influence coefficients.
+
+The influence coefficients are found by solving an independent least
+squares problem at every point in frequency space. Rather than calling
+LAPACK once per frequency, the frequencies are grouped by the local
+states selected with the basis' `_column_mask` method and each group
+is solved with stacked calls. Real bases are transformed with `rfftn`
+so only the independent half of the frequencies, which are conjugate
+symmetric, is solved. The microstructure functions of complex bases are
+not conjugate symmetric and all their frequencies are solved.
+
+The problems are solved either with the SVD, like LAPACK's `gelsd`,
+with QR factorizations without column pivoting, which is several times
+faster for the small, well conditioned problems typical of MKS, or with
+Cholesky factorizations of the normal equations, like LAPACK's `posv`,
+which is faster still but squares the condition number of the problems.
+
+The groups are split into tiles of frequencies so that the problems
+being solved fit in the L2 cache. The tile size in bytes defaults to
+1 MiB and can be changed with the `PYMKS_TILE_BYTES` environment
+variable. Tiles are solved on `n_jobs` parallel threads.
+
+If Numba is installed, the stacked problems are instead solved in a
+compiled loop over the frequencies, which avoids the overhead of the
+pseudo-inverse and runs on `n_jobs` Numba threads.
+
+CuPy arrays are solved on the GPU with the stacked pseudo-inverse.
+"""
+
+import os
+from contextlib import contextmanager
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from threadpoolctl import threadpool_limits
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+
+def tile_bytes():
+    """Determine the tile size from the `PYMKS_TILE_BYTES` environment
+    variable.
+
+    Returns:
+        the tile size in bytes, 1 MiB if `PYMKS_TILE_BYTES` is not set
+        or is not a positive integer
+    """
+    try:
+        value = int(os.environ.get('PYMKS_TILE_BYTES', 2 ** 20))
+    except ValueError:
+        value = 0
+    return value if value > 0 else 2 ** 20
+
+
+TILE_BYTES = tile_bytes()
+
+
+def get_array_module(arr):
+    """Get the array module for an array.
+
+    Args:
+        arr: a Numpy or CuPy array
+
+    Returns:
+        `cupy` for CuPy arrays and `numpy` otherwise
+
+    >>> get_array_module(np.zeros(2)).__name__
+    'numpy'
+    """
+    if type(arr).__module__.split('.')[0] == 'cupy':
+        import cupy
+        return cupy
+    return np
+
+
+def lstsq_batch(A, b, rcond):
+    """Solve a stack of least squares problems.
+
+    The problems are solved with the pseudo-inverse so that rank
+    deficient systems have the minimum norm solution, the same as
+    `scipy.linalg.lstsq`.
+
+    Args:
+        A: array of shape `(n_problems, n_samples, n_states)`
+        b: array of shape `(n_problems, n_samples)`
+        rcond: cutoff for small singular values relative to the largest
+            singular value
+
+    Returns:
+        the solutions, an array of shape `(n_problems, n_states)`
+
+    >>> from scipy.linalg import lstsq
+    >>> np.random.seed(0)
+    >>> A = np.random.random((4, 6, 3))
+    >>> b = np.random.random((4, 6))
+    >>> x_test = [lstsq(A_, b_, 1e-12)[0] for A_, b_ in zip(A, b)]
+    >>> assert np.allclose(lstsq_batch(A, b, 1e-12), x_test)
+
+    Rank deficient problems give the minimum norm solution.
+
+    >>> A = np.ones((1, 2, 2))
+    >>> b = np.array([[2., 2.]])
+    >>> assert np.allclose(lstsq_batch(A, b, 1e-12), [[1, 1]])
+    """
+    xp = get_array_module(A)
+    return xp.matmul(xp.linalg.pinv(A, rcond), b[..., None])[..., 0]
+
+
+def lstsq_qr(A, b, rcond):
+    """Solve a stack of least squares problems with QR factorizations.
+
+    Unlike LAPACK's `gelsy`, the columns are not pivoted, so the
+    rank is only estimated from the diagonal of R.
+
+    Problems with a diagonal of R below `rcond` times its largest
+    diagonal are rank deficient and are solved with `lstsq_batch`
+    instead, as are stacks with fewer samples than states.
+
+    Args:
+        A: array of shape `(n_problems, n_samples, n_states)`
+        b: array of shape `(n_problems, n_samples)`
+        rcond: cutoff for small diagonals of R relative to the largest
+            diagonal
+
+    Returns:
+        the solutions, an array of shape `(n_problems, n_states)`
+
+    >>> np.random.seed(0)
+    >>> A = np.random.random((4, 6, 3))
+    >>> A[0, :, 2] = A[0, :, 1]
+    >>> b = np.random.random((4, 6))
+    >>> assert np.allclose(lstsq_qr(A, b, 1e-12), lstsq_batch(A, b, 1e-12))
+    >>> assert np.allclose(lstsq_qr(A[:, :2], b[:, :2], 1e-12),
+    ...                    lstsq_batch(A[:, :2], b[:, :2], 1e-12))
+    """
+    if A.shape[-2] < A.shape[-1]:
+        return lstsq_batch(A, b, rcond)
+    Q, R = np.linalg.qr(A)
+    diagonal = abs(np.diagonal(R, axis1=-2, axis2=-1))
+    deficient = np.any(diagonal <= rcond * diagonal.max(axis=-1)[:, None],
+                       axis=-1)
+    R[deficient] = np.eye(R.shape[-1])
+    x = np.linalg.solve(R, np.matmul(np.conj(Q).swapaxes(-1, -2),
+                                     b[..., None]))[..., 0]
+    if np.any(deficient):
+        x[deficient] = lstsq_batch(A[deficient], b[deficient], rcond)
+    return x
+
+
+def cho_solve(L, b):
+    """Solve a stack of systems from their Cholesky factors.
+
+    The forward and back substitutions loop over the states and are
+    vectorized over the stack, the same as LAPACK's `potrs`.
+
+    Args:
+        L: lower triangular factors of shape `(n_problems, n_states,
+            n_states)`
+        b: array of shape `(n_problems, n_states)`
+
+    Returns:
+        the solutions, an array of shape `(n_problems, n_states)`
+
+    >>> np.random.seed(0)
+    >>> A = np.random.random((4, 6, 3)) + 1j * np.random.random((4, 6, 3))
+    >>> gram = np.matmul(np.conj(A).swapaxes(-1, -2), A)
+    >>> b = np.random.random((4, 3))
+    >>> assert np.allclose(cho_solve(np.linalg.cholesky(gram), b),
+    ...                    np.linalg.solve(gram, b[..., None])[..., 0])
+    """
+    x = np.array(b, dtype=np.result_type(L, b))
+    for i in range(L.shape[-1]):
+        x[:, i] -= np.einsum('ij,ij->i', L[:, i, :i], x[:, :i])
+        x[:, i] /= L[:, i, i]
+    for i in reversed(range(L.shape[-1])):
+        x[:, i] -= np.einsum('ij,ij->i', np.conj(L[:, i + 1:, i]),
+                             x[:, i + 1:])
+        x[:, i] /= np.conj(L[:, i, i])
+    return x
+
+
+def lstsq_cholesky(A, b, rcond):
+    """Solve a stack of least squares problems with the normal equations.
+
+    The Gram matrices are factorized with Cholesky factorizations and
+    the systems solved with `cho_solve`. As forming the Gram matrices
+    squares the condition number, problems with a diagonal of the
+    Cholesky factor below the square root of `rcond` times its largest
+    diagonal are solved with `lstsq_qr` instead, as are all the problems
+    if any factorization fails.
+
+    Args:
+        A: array of shape `(n_problems, n_samples, n_states)`
+        b: array of shape `(n_problems, n_samples)`
+        rcond: the square root of `rcond` is the cutoff for small
+            diagonals of the Cholesky factor relative to its largest
+            diagonal
+
+    Returns:
+        the solutions, an array of shape `(n_problems, n_states)`
+
+    >>> np.random.seed(0)
+    >>> A = np.random.random((4, 6, 3)) + 1j * np.random.random((4, 6, 3))
+    >>> b = np.random.random((4, 6))
+    >>> assert np.allclose(lstsq_cholesky(A, b, 1e-12),
+    ...                    lstsq_batch(A, b, 1e-12))
+    >>> A[0, :, 2] = A[0, :, 1]
+    >>> assert np.allclose(lstsq_cholesky(A, b, 1e-12),
+    ...                    lstsq_batch(A, b, 1e-12))
+    """
+    if A.shape[-2] < A.shape[-1]:
+        return lstsq_batch(A, b, rcond)
+    A_H = np.conj(A).swapaxes(-1, -2)
+    gram = np.matmul(A_H, A)
+    try:
+        L = np.linalg.cholesky(gram)
+    except np.linalg.LinAlgError:
+        return lstsq_qr(A, b, rcond)
+    diagonal = np.diagonal(L, axis1=-2, axis2=-1).real
+    deficient = np.any(
+        diagonal <= np.sqrt(rcond) * diagonal.max(axis=-1)[:, None], axis=-1
+    )
+    L[deficient] = np.eye(L.shape[-1])
+    x = cho_solve(L, np.matmul(A_H, b[..., None])[..., 0])
+    if np.any(deficient):
+        x[deficient] = lstsq_qr(A[deficient], b[deficient], rcond)
+    return x
+
+
+def group_frequencies(column_mask):
+    """Group the frequencies that use the same local states.
+
+    Args:
+        column_mask: boolean array of shape `(n_x, ..., n_states)`
+            marking the local states used at each frequency, from the
+            basis' `_column_mask` method
+
+    Returns:
+        a list of `(columns, index)` tuples where `columns` are the
+        local states used by the frequencies in `index`, a tuple of
+        index arrays, in order of the groups' first frequencies
+
+    >>> from pymks.bases import PrimitiveBasis
+    >>> groups = group_frequencies(PrimitiveBasis(3)._column_mask((2, 2)))
+    >>> for columns, index in groups:
+    ...     print(columns, index)
+    [0 1 2] (array([0]), array([0]))
+    [0 1] (array([0, 1, 1]), array([1, 0, 1]))
+    """
+    shape = column_mask.shape[:-1]
+    masks, first, inverse = np.unique(
+        column_mask.reshape(-1, column_mask.shape[-1]),
+        axis=0,
+        return_index=True,
+        return_inverse=True
+    )
+    inverse = inverse.ravel()
+    frequencies = np.split(np.argsort(inverse, kind='stable'),
+                           np.cumsum(np.bincount(inverse))[:-1])
+    return [(np.flatnonzero(masks[group]),
+             np.unravel_index(frequencies[group], shape))
+            for group in np.argsort(first)]
+
+
+def _lstsq_loop(A, b, rcond, out):
+    """Solve each least squares problem in the stack into `out`.
+    """
+    for i in numba.prange(A.shape[0]):  # pylint: disable=not-an-iterable
+        out[i] = np.linalg.lstsq(A[i], b[i], rcond)[0]
+
+
+if numba is not None:
+    _lstsq_loop = numba.njit(parallel=True, cache=True)(_lstsq_loop)
+
+
+@contextmanager
+def numba_threads(n_jobs):
+    """Run Numba's parallel loops on `n_jobs` threads.
+
+    The number of threads is restored on exit.
+
+    Args:
+        n_jobs: the number of Numba threads to use, -1 for all of them
+    """
+    n_threads = numba.get_num_threads()
+    numba.set_num_threads(min(effective_n_jobs(n_jobs),
+                              numba.config.NUMBA_NUM_THREADS))
+    try:
+        yield
+    finally:
+        numba.set_num_threads(n_threads)
+
+
+def lstsq_numba(A, b, rcond, n_jobs=1):
+    """Solve a stack of least squares problems with Numba.
+
+    Args:
+        A: array of shape `(n_problems, n_samples, n_states)`
+        b: array of shape `(n_problems, n_samples)`
+        rcond: cutoff for small singular values relative to the largest
+            singular value
+        n_jobs: the number of Numba threads to use
+
+    Returns:
+        the solutions, an array of shape `(n_problems, n_states)`
+    """
+    dtype = np.result_type(A, b)
+    A = np.ascontiguousarray(A, dtype=dtype)
+    b = np.ascontiguousarray(b, dtype=dtype)
+    out = np.zeros((A.shape[0], A.shape[-1]), dtype=dtype)
+    with numba_threads(n_jobs):
+        _lstsq_loop(A, b, rcond, out)
+    return out
+
+
+def split_tiles(groups, size):
+    """Split groups of frequencies into tiles.
+
+    Args:
+        groups: list of `(columns, index)` tuples from `group_frequencies`
+        size: the maximum number of frequencies in a tile
+
+    Returns:
+        a list of `(columns, index)` tuples, one for each tile
+
+    >>> groups = [(np.array([0, 1]), (np.arange(5), np.arange(5)))]
+    >>> for columns, index in split_tiles(groups, 2):
+    ...     print(columns, index[0])
+    [0 1] [0 1]
+    [0 1] [2 3]
+    [0 1] [4]
+    """
+    return [(columns, tuple(i[start:start + size] for i in index))
+            for columns, index in groups
+            for start in range(0, len(index[0]), size)]
+
+
+def _solve_tile(FX, Fy, columns, index, rcond, driver='svd', n_jobs=1):
+    """Gather and solve the least squares problems for a single tile.
+    """
+    A, b = FX[index][..., columns], Fy[index]
+    if driver == 'qr':
+        return lstsq_qr(A, b, rcond)
+    if driver == 'cholesky':
+        return lstsq_cholesky(A, b, rcond)
+    if numba is not None:
+        return lstsq_numba(A, b, rcond, n_jobs=n_jobs)
+    return lstsq_batch(A, b, rcond)
+
+
+def solve_tiles(FX, Fy, tiles, rcond, driver='svd', n_jobs=1):
+    """Solve the least squares problems tile by tile.
+
+    With Numba and the 'svd' driver, each tile is solved on `n_jobs`
+    Numba threads. Otherwise, the tiles are solved on `n_jobs` parallel
+    threads. The LAPACK calls release the GIL so threads are used to
+    avoid copying the arrays to other processes. The BLAS threads are
+    limited to one while solving to avoid oversubscription.
+
+    Args:
+        FX: the discretized microstructure in frequency space, an
+            `(n_x, ..., n_samples, n_states)` shaped array
+        Fy: the response in frequency space, an `(n_x, ..., n_samples)`
+            shaped array
+        tiles: list of `(columns, index)` tuples from `split_tiles`
+        rcond: cutoff for small singular values relative to the largest
+            singular value
+        driver: 'svd' to use the SVD, 'qr' to use QR
+            factorizations or 'cholesky' to use the normal equations
+        n_jobs: the number of threads to use
+
+    Returns:
+        list with the solutions for each tile
+
+    >>> np.random.seed(0)
+    >>> FX = np.random.random((5, 6, 3))
+    >>> Fy = np.random.random((5, 6))
+    >>> tiles = split_tiles([(np.arange(3), (np.arange(5),))], 2)
+    >>> for driver in ('svd', 'qr', 'cholesky'):
+    ...     Fkernel = solve_tiles(FX, Fy, tiles, 1e-12, driver, n_jobs=2)
+    ...     assert np.allclose(np.concatenate(Fkernel),
+    ...                        lstsq_batch(FX, Fy, 1e-12))
+    """
+    n_jobs = effective_n_jobs(n_jobs)
+    with threadpool_limits(limits=1):
+        if (numba is not None and driver == 'svd') or n_jobs == 1:
+            return [_solve_tile(FX, Fy, columns, index, rcond, driver,
+                                n_jobs=n_jobs)
+                    for columns, index in tiles]
+        return Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(_solve_tile)(FX, Fy, columns, index, rcond, driver)
+            for columns, index in tiles
+        )
+
+
+def fit_fourier(FX, Fy, column_mask, rcond, driver='svd', n_jobs=1):
+    """Calculate the influence coefficients in frequency space.
+
+    Args:
+        FX: the discretized microstructure in frequency space, an
+            `(n_samples, n_x, ..., n_states)` shaped array
+        Fy: the response in frequency space, an `(n_samples, n_x, ...)`
+            shaped array
+        column_mask: boolean array of shape `(n_x, ..., n_states)`
+            marking the local states used at each frequency
+        rcond: cutoff for small singular values relative to the largest
+            singular value
+        driver: 'svd' to use the SVD, 'qr' to use QR
+            factorizations or 'cholesky' to use the normal equations,
+            ignored for CuPy arrays
+        n_jobs: the number of threads used to solve the problems
+
+    Returns:
+        the influence coefficients, an `(n_x, ..., n_states)` shaped
+        array
+
+    >>> from scipy.linalg import lstsq
+    >>> np.random.seed(0)
+    >>> FX = np.random.random((5, 3, 2, 2)) + 1j * np.random.random((5, 3, 2, 2))
+    >>> Fy = np.random.random((5, 3, 2))
+    >>> column_mask = np.ones((3, 2, 2), dtype=bool)
+    >>> column_mask[1:, :, -1] = column_mask[0, 1:, -1] = False
+    >>> Fkernel = fit_fourier(FX, Fy, column_mask, 1e-12)
+    >>> x_test = lstsq(FX[:, 1, 0, :1], Fy[:, 1, 0], 1e-12)[0]
+    >>> assert np.allclose(Fkernel[1, 0], [x_test[0], 0])
+    >>> x_test = lstsq(FX[:, 0, 0], Fy[:, 0, 0], 1e-12)[0]
+    >>> assert np.allclose(Fkernel[0, 0], x_test)
+    """
+    xp = get_array_module(FX)
+    Fkernel = xp.zeros(FX.shape[1:],
+                       dtype=np.result_type(FX.dtype, Fy.dtype, np.complex64))
+    ## move the samples next to the local states so that each
+    ## frequency's problem is a contiguous block
+    FX = xp.ascontiguousarray(xp.moveaxis(FX, 0, -2))
+    Fy = xp.ascontiguousarray(xp.moveaxis(Fy, 0, -1))
+    groups = group_frequencies(column_mask)
+    if xp is np:
+        frequency_bytes = FX.shape[-2] * FX.shape[-1] * FX.itemsize
+        tiles = split_tiles(groups, max(1, TILE_BYTES // frequency_bytes))
+        Fkernel_tiles = solve_tiles(FX, Fy, tiles, rcond, driver,
+                                    n_jobs=n_jobs)
+    else:
+        ## the GPU is better off with the whole group at once
+        tiles = [(xp.asarray(columns), tuple(xp.asarray(i) for i in index))
+                 for columns, index in groups]
+        Fkernel_tiles = [lstsq_batch(FX[index][..., columns], Fy[index], rcond)
+                         for columns, index in tiles]
+    for (columns, index), Fkernel_ in zip(tiles, Fkernel_tiles):
+        Fkernel[tuple(i[:, None] for i in index) + (columns[None],)] = \
+            Fkernel_
+    return Fkernel
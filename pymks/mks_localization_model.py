@@ -1,5 +1,8 @@
+import copy
+
 from .filter import Filter
-from scipy.linalg import lstsq
+from .lstsq import fit_fourier
+from .bases.fftmodule import empty_aligned
 from sklearn.linear_model import LinearRegression
 import numpy as np
 
@@ -59,29 +62,80 @@ class MKSLocalizationModel(LinearRegression):
     >>> assert np.allclose(np.fft.fftshift(coef_, axes=(0,)), model.coef_)
     """
 
-    def __init__(self, basis, n_states=None, n_jobs=1, lstsq_rcond=None):
+    def __init__(self, basis, n_states=None, n_jobs=1, lstsq_rcond=None,
+                 device='cpu', dtype=np.float64, lstsq_driver='qr'):
         """
         Instantiate a MKSLocalizationModel.
 
         Args:
             basis (class): an instance of a bases class.
             n_states (int, optional): number of local states
-            n_jobs (int, optional): number of parallel jobs to run, only used
-                if pyfftw is installed.
-            lstsq_rcond (float, optional): rcond argument to scipy.linalg.lstsq
-                function. Defaults to 4 orders of magnitude above machine
-                epsilon.
+            n_jobs (int, optional): number of parallel jobs to run for the
+                least squares fit and, if pyfftw is installed, the FFTs.
+            lstsq_rcond (float, optional): cutoff for small singular values
+                in the least squares solve relative to the largest singular
+                value. Defaults to 4 orders of magnitude above machine
+                epsilon for `dtype`.
+            device (str, optional): either 'cpu' or 'cuda'. With 'cuda',
+                the FFTs and the least squares fit run on the GPU using
+                CuPy, which must be installed.
+            dtype (type, optional): the floating point precision of the
+                discretized microstructure and of the fit, either
+                `np.float64` (default) or `np.float32`. With `np.float32`
+                the influence coefficients are `np.complex64`.
+            lstsq_driver (str, optional): either 'qr' (default) to solve
+                the least squares problems with QR factorizations without
+                column pivoting, 'svd' to use the SVD, which is slower but
+                more robust for poorly conditioned problems, or 'cholesky'
+                to use Cholesky factorizations of the normal equations,
+                which is faster but less accurate for poorly conditioned
+                problems.
 
+        >>> from .bases import PrimitiveBasis
+        >>> MKSLocalizationModel(PrimitiveBasis(2), device='gpu')
+        Traceback (most recent call last):
+        ...
+        RuntimeError: device must be either 'cpu' or 'cuda'.
+        >>> MKSLocalizationModel(PrimitiveBasis(2), dtype=np.float16)
+        Traceback (most recent call last):
+        ...
+        RuntimeError: dtype must be either np.float32 or np.float64.
+        >>> MKSLocalizationModel(PrimitiveBasis(2), lstsq_driver='gelss')
+        Traceback (most recent call last):
+        ...
+        RuntimeError: lstsq_driver must be one of 'qr', 'svd' or 'cholesky'.
         """
         self.basis = basis
         self.n_states = n_states
         if n_states is None:
             self.n_states = basis.n_states
         self.domain = basis.domain
+        self.n_jobs = n_jobs
         self.basis._n_jobs = n_jobs
+        try:
+            valid_dtype = dtype is not None and \
+                np.dtype(dtype) in (np.float32, np.float64)
+        except TypeError:
+            valid_dtype = False
+        if not valid_dtype:
+            raise RuntimeError("dtype must be either np.float32 or "
+                               "np.float64.")
+        self.dtype = dtype
         self.lstsq_rcond = lstsq_rcond
         if self.lstsq_rcond is None:
-            self.lstsq_rcond = np.finfo(float).eps*1e4
+            self.lstsq_rcond = np.finfo(dtype).eps*1e4
+        if device not in ('cpu', 'cuda'):
+            raise RuntimeError("device must be either 'cpu' or 'cuda'.")
+        if device == 'cuda':
+            try:
+                import cupy  # pylint: disable=unused-import
+            except ImportError:
+                raise RuntimeError("device 'cuda' requires CuPy.")
+        self.device = device
+        if lstsq_driver not in ('qr', 'svd', 'cholesky'):
+            raise RuntimeError("lstsq_driver must be one of 'qr', 'svd' "
+                               "or 'cholesky'.")
+        self.lstsq_driver = lstsq_driver
 
     def fit(self, X, y, size=None):
         """
@@ -109,20 +163,101 @@ class MKSLocalizationModel(LinearRegression):
         ...                                             [[-0.5,  0  ],
         ...                                              [  -1,  0  ]]])
         """
-        self.basis = self.basis.__class__(self.n_states, self.domain)
+        self.fit_precomputed(*self.prepare(X, y, size))
+
+    def prepare(self, X, y, size=None):
+        """
+        Discretizes the microstructure and takes the FFT of the
+        microstructure function and the response field, the expensive
+        part of `fit`. The result can be passed to `fit_precomputed` any
+        number of times, for example to try several values of
+        `lstsq_rcond`, without repeating that work.
+
+        The discretized microstructure depends on the local states and
+        the domain, so `prepare` has to be called again if either of them
+        changes.
+
+        Args:
+            X (ND array): The microstructure, an `(n_samples, n_x, ...)`
+                shaped array where `n_samples` is the number of samples and
+                `n_x` is the spatial discretization.
+            y (ND array): The response field, same shape as `X`.
+            size (tuple, optional): Alters the shape of X and y during the
+                calibration of the influence coefficients. If None, the size
+                of the influence coefficients is the same shape as `X` and `y`.
+        Returns:
+            The FFTs of the microstructure function and of the response
+            field, `FX` and `Fy`, and the spatial shape of the data,
+            `axes_shape`.
+
+        Example
+
+        >>> X = np.linspace(0, 1, 4).reshape((1, 2, 2))
+        >>> y = X.swapaxes(1, 2)
+        >>> from .bases import PrimitiveBasis
+        >>> model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+        >>> FX, Fy, axes_shape = model.prepare(X, y)
+        >>> FX.shape, Fy.shape, axes_shape
+        ((1, 2, 2, 2), (1, 2, 2), (2, 2))
+        >>> for rcond in (1e-12, 1e-6):
+        ...     model.lstsq_rcond = rcond
+        ...     model.fit_precomputed(FX, Fy, axes_shape)
+        ...     assert np.allclose(y, model.predict(X))
+        """
+        ## the basis may be shared with other models so the model works
+        ## on its own copy, only rebuilt if the local states or the
+        ## domain have changed
+        if np.array_equal(self.basis.n_states, self.n_states) and \
+           np.array_equal(self.basis.domain, self.domain):
+            self.basis = copy.copy(self.basis)
+        else:
+            self.basis = self.basis.__class__(self.n_states, self.domain)
+        self.basis._n_jobs = self.n_jobs
         if size is not None:
             y = self.basis._reshape_localization_data(y, size)
             X = self.basis._reshape_feature(X, size)
         self.basis._check_shape(X.shape, y.shape)
-        X_ = self.basis.discretize(X)
-        FX = self.basis._fftn(X_)
-        Fy = self.basis._fftn(y)
-        Fkernel = np.zeros(FX.shape[1:], dtype=np.complex)
-        s0 = (slice(None),)
-        for ijk in np.ndindex(FX.shape[1:-1]):
-            s1 = self.basis._select_slice(ijk, s0)
-            Fkernel[ijk + s1] = lstsq(FX[s0 + ijk + s1], Fy[s0 + ijk],
-                                      self.lstsq_rcond)[0]
+        X_ = self._to_device(self._discretize(X))
+        y = self._to_device(y.astype(self.dtype, copy=False))
+        ## Numpy's fft always returns double precision
+        complex_dtype = np.result_type(self.dtype, np.complex64)
+        FX = self.basis._fftn(X_).astype(complex_dtype, copy=False)
+        Fy = self.basis._fftn(y).astype(complex_dtype, copy=False)
+        return FX, Fy, self.basis._axes_shape
+
+    def fit_precomputed(self, FX, Fy, axes_shape):
+        """
+        Calculates the influence coefficients from the output of
+        `prepare`. The data does not have to come from the most recent
+        call to `prepare`, but it must have been prepared with the
+        model's current local states.
+
+        Args:
+            FX (ND array): The FFT of the microstructure function.
+            Fy (ND array): The FFT of the response field.
+            axes_shape (tuple): The spatial shape of the data.
+
+        >>> from .bases import PrimitiveBasis
+        >>> model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+        >>> FX, Fy, _ = model.prepare(np.zeros((1, 2, 2)), np.zeros((1, 2, 2)))
+        >>> model.fit_precomputed(FX, Fy, (3, 3))
+        Traceback (most recent call last):
+        ...
+        RuntimeError: FX and Fy do not match axes_shape and the local states.
+        """
+        frequency_shape = tuple(axes_shape)
+        if not np.issubdtype(self.basis._dtype, np.complexfloating):
+            frequency_shape = frequency_shape[:-1] + \
+                (frequency_shape[-1] // 2 + 1,)
+        if FX.shape[1:] != frequency_shape + (len(self.basis.n_states),) \
+           or Fy.shape != FX.shape[:-1]:
+            raise RuntimeError("FX and Fy do not match axes_shape and the "
+                               "local states.")
+        self.basis._axes = np.arange(len(axes_shape)) + 1
+        self.basis._axes_shape = tuple(axes_shape)
+        column_mask = self.basis._column_mask(FX.shape[1:-1])
+        Fkernel = fit_fourier(FX, Fy, column_mask, self.lstsq_rcond,
+                              self.lstsq_driver, n_jobs=self.n_jobs)
         self._filter = Filter(Fkernel[None], self.basis)
 
     @property
@@ -130,13 +265,14 @@ class MKSLocalizationModel(LinearRegression):
         """Returns the coefficients in real space with origin shifted to the
         center.
         """
-        return self._filter._frequency_2_real(copy=True)[0]
+        return self._to_host(self._filter._frequency_2_real(copy=True)[0])
 
     @coef_.setter
     def coef_(self, kernel):
         """Setter for influence coefficients.
         """
-        self._filter._Fkernel = self._filter._real_2_frequency(kernel[None])
+        self._filter._Fkernel = self._filter._real_2_frequency(
+            self._to_device(kernel[None]))
         self.basis._axes_shape = kernel.shape[:-1]
 
     def predict(self, X):
@@ -174,8 +310,56 @@ class MKSLocalizationModel(LinearRegression):
             raise AttributeError("fit() method must be run before predict().")
         _pred_shape = self.basis._pred_shape(X)
         X = self.basis._reshape_feature(X, self.basis._axes_shape)
-        X_ = self.basis.discretize(X)
-        return self._filter.convolve(X_).reshape(_pred_shape).real
+        X_ = self._to_device(self._discretize(X))
+        y = self._filter.convolve(X_, n_jobs=self.n_jobs)
+        y = y.reshape(_pred_shape).real
+        return self._to_host(y)
+
+    def _discretize(self, X):
+        """Discretize the microstructure in the model's precision.
+
+        Bases that can discretize in place write into a single aligned
+        array so that no temporary arrays of the discretized size are
+        made. The array is allocated on each call so that `predict` can
+        be called from several threads.
+
+        Args:
+            X (ND array): The microstructure, an `(n_samples, n_x, ...)`
+                shaped array.
+        Returns:
+            The discretized microstructure.
+
+        >>> from .bases import PrimitiveBasis
+        >>> model = MKSLocalizationModel(PrimitiveBasis(2, [0, 1]),
+        ...                              dtype=np.float32)
+        >>> X_ = model._discretize(np.ones((1, 3, 3)))
+        >>> X_.shape, X_.dtype
+        ((1, 3, 3, 2), dtype('float32'))
+        >>> assert np.allclose(X_[..., 1], 1)
+        """
+        dtype = np.dtype(self.dtype)
+        if np.issubdtype(self.basis._dtype, np.complexfloating):
+            dtype = np.result_type(dtype, np.complex64)
+        if not self.basis._discretizes_in_place:
+            return self.basis.discretize(X).astype(dtype, copy=False)
+        out = empty_aligned(self.basis._discretized_shape(X), dtype=dtype)
+        return self.basis.discretize(X, out=out)
+
+    def _to_device(self, arr):
+        """Copy an array to the GPU if the model's device is 'cuda'.
+        """
+        if self.device == 'cuda':
+            import cupy
+            return cupy.asarray(arr)
+        return arr
+
+    def _to_host(self, arr):
+        """Copy an array back from the GPU if the model's device is 'cuda'.
+        """
+        if self.device == 'cuda':
+            import cupy
+            return cupy.asnumpy(arr)
+        return arr
 
     def resize_coeff(self, size):
         """Scale the size of the coefficients and pad with zeros.
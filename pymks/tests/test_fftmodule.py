@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+
+def test_execute_fftw_keeps_input():
+    pyfftw = pytest.importorskip('pyfftw')
+    from pymks.bases.fftmodule import execute_fftw
+    np.random.seed(0)
+    data = pyfftw.empty_aligned((2, 8, 5), dtype=complex)
+    data[:] = np.random.random(data.shape) + 1j * np.random.random(data.shape)
+    data_copy = data.copy()
+    y0 = execute_fftw(pyfftw.builders.irfftn, data, (1, 2),
+                      destroys_input=True, s=(8, 8))
+    y1 = execute_fftw(pyfftw.builders.irfftn, data, (1, 2),
+                      destroys_input=True, s=(8, 8))
+    assert np.allclose(data, data_copy)
+    assert np.allclose(y0, np.fft.irfftn(data_copy, s=(8, 8), axes=(1, 2)))
+    assert np.allclose(y0, y1)
+
+
+@pytest.mark.parametrize('planner_effort', ['FFTW_ESTIMATE', 'FFTW_MEASURE'])
+def test_execute_fftw_forward(monkeypatch, planner_effort):
+    pyfftw = pytest.importorskip('pyfftw')
+    from pymks.bases.fftmodule import execute_fftw
+    monkeypatch.setenv('PYMKS_FFTW_PLANNER_EFFORT', planner_effort)
+    np.random.seed(0)
+    data = pyfftw.empty_aligned((2, 8, 8))
+    data[:] = np.random.random(data.shape)
+    data_copy = data.copy()
+    Fdata = execute_fftw(pyfftw.builders.rfftn, data, (1, 2))
+    assert np.allclose(data, data_copy)
+    assert np.allclose(Fdata, np.fft.rfftn(data_copy, axes=(1, 2)))
+
+
+def test_execute_fftw_threads():
+    pyfftw = pytest.importorskip('pyfftw')
+    from pymks.bases.fftmodule import execute_fftw
+    np.random.seed(0)
+    X = np.random.random((160, 4, 32, 32))
+
+    def transform(x):
+        return execute_fftw(pyfftw.builders.rfftn, x, (1, 2))
+
+    with ThreadPoolExecutor(8) as executor:
+        FX = list(executor.map(transform, X))
+    assert np.allclose(FX, np.fft.rfftn(X, axes=(2, 3)))
+
+
+def test_wisdom_path(monkeypatch):
+    from pymks.bases.fftmodule import wisdom_path
+    monkeypatch.delenv('PYMKS_FFTW_WISDOM', raising=False)
+    assert os.path.basename(wisdom_path()).startswith('.pymks_wisdom_')
+
+
+def test_wisdom(monkeypatch, tmpdir):
+    pyfftw = pytest.importorskip('pyfftw')
+    from pymks.bases.fftmodule import wisdom_path, save_wisdom, load_wisdom
+    path = str(tmpdir.join('wisdom'))
+    monkeypatch.setenv('PYMKS_FFTW_WISDOM', path)
+    assert wisdom_path() == path
+    data = pyfftw.empty_aligned((2, 6, 6))
+    output = pyfftw.empty_aligned((2, 6, 4), dtype=complex)
+
+    def plan(*flags):
+        return pyfftw.FFTW(data, output, axes=(1, 2),
+                           flags=('FFTW_MEASURE',) + flags)
+
+    plan()
+    save_wisdom(wisdom_path())
+    pyfftw.forget_wisdom()
+    with pytest.raises(RuntimeError):
+        plan('FFTW_WISDOM_ONLY')
+    load_wisdom(wisdom_path())
+    plan('FFTW_WISDOM_ONLY')
+
+
+def test_save_wisdom_failure(tmpdir):
+    pytest.importorskip('pyfftw')
+    from pymks.bases.fftmodule import save_wisdom
+    path = tmpdir.mkdir('wisdom')
+    save_wisdom(str(path))
+    assert tmpdir.listdir() == [path]
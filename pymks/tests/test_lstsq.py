@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('4096', 4096),
+    ('abc', 2 ** 20),
+    ('-1', 2 ** 20),
+])
+def test_tile_bytes(monkeypatch, value, expected):
+    from pymks.lstsq import tile_bytes
+    monkeypatch.setenv('PYMKS_TILE_BYTES', value)
+    assert tile_bytes() == expected
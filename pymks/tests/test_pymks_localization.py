@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 from test import get_delta_data, get_random_data
 
 
@@ -136,5 +137,163 @@ def test_setting_kernel():
     model.coef_ = coefs
     assert np.allclose(model.predict(X_delta), y, atol=1e-4)
 
+
+def test_fit_half_spectrum():
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((20, 6, 7))
+    y = np.random.random((20, 6, 7))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+    model.fit(X, y)
+    assert model._filter._Fkernel.shape == (1, 6, 4, 2)
+    assert model.coef_.shape == (6, 7, 2)
+    assert model.predict(X).shape == X.shape
+
+
+def test_fit_single_precision():
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((20, 6, 7))
+    y = np.random.random((20, 6, 7))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+    model.fit(X, y)
+    model32 = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]),
+                                   dtype=np.float32)
+    model32.fit(X, y)
+    assert model32._filter._Fkernel.dtype == np.complex64
+    assert np.allclose(model32.coef_, model.coef_, atol=1e-4)
+    assert np.allclose(model32.predict(X), model.predict(X), atol=1e-4)
+
+
+def test_prepare_spatial_fft():
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((3, 4, 5, 6))
+    y = np.random.random((3, 4, 5, 6))
+    basis = PrimitiveBasis(2, [0, 1])
+    model = MKSLocalizationModel(basis=basis)
+    FX, Fy, axes_shape = model.prepare(X, y)
+    X_ = basis.discretize(X)
+    assert np.allclose(FX, np.fft.rfftn(X_, axes=(1, 2, 3)))
+    assert np.allclose(Fy, np.fft.rfftn(y, axes=(1, 2, 3)))
+    assert axes_shape == (4, 5, 6)
+
+
+def test_fit_precomputed():
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    XA = np.random.random((10, 6, 6))
+    yA = np.random.random((10, 6, 6))
+    XB = np.random.random((10, 8, 10))
+    yB = np.random.random((10, 8, 10))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+    model.fit(XA, yA)
+    coef_ = model.coef_
+    prepared = model.prepare(XA, yA)
+    model.prepare(XB, yB)
+    model.fit_precomputed(*prepared)
+    assert np.allclose(model.coef_, coef_)
+    assert model.predict(XA).shape == XA.shape
+
+
+def test_predict_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((20, 6, 7))
+    y = np.random.random((20, 6, 7))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+    model.fit(X, y)
+    X_test = np.random.random((200, 2, 6, 7))
+    y_test = [model.predict(x) for x in X_test]
+    with ThreadPoolExecutor(8) as executor:
+        y_threads = list(executor.map(model.predict, X_test))
+    assert np.allclose(y_threads, y_test)
+
+
+def test_fit_n_jobs():
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((5, 4, 4))
+    basis = PrimitiveBasis(2, [0, 1])
+    model = MKSLocalizationModel(basis=basis, n_jobs=4)
+    MKSLocalizationModel(basis=basis)
+    model.fit(X, X)
+    assert model.basis._n_jobs == 4
+    model.set_params(n_jobs=3)
+    model.fit(X, X)
+    assert model.basis._n_jobs == 3
+    assert basis._n_jobs == 1
+
+
+def test_fit_n_states():
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((5, 4, 4))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+    model.fit(X, X)
+    basis = model.basis
+    model.fit(X, X)
+    assert model.basis is not basis
+    assert len(model.basis.n_states) == 2
+    model.set_params(n_states=np.arange(3))
+    model.fit(X, X)
+    assert len(model.basis.n_states) == 3
+    assert model.coef_.shape == (4, 4, 3)
+
+
+def test_cuda_without_cupy(monkeypatch):
+    import sys
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    monkeypatch.setitem(sys.modules, 'cupy', None)
+    with pytest.raises(RuntimeError):
+        MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]), device='cuda')
+
+
+def test_fit_cuda():
+    pytest.importorskip('cupy')
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    np.random.seed(0)
+    X = np.random.random((20, 6, 7))
+    y = np.random.random((20, 6, 7))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]))
+    model.fit(X, y)
+    model_cuda = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]),
+                                      device='cuda')
+    model_cuda.fit(X, y)
+    assert np.allclose(model_cuda.coef_, model.coef_)
+    assert np.allclose(model_cuda.predict(X), model.predict(X))
+
+
+def test_predict_numba_threads(monkeypatch):
+    pytest.importorskip('numba')
+    from pymks import MKSLocalizationModel
+    from pymks import PrimitiveBasis
+    from pymks import filter as filter_module
+    np.random.seed(0)
+    X = np.random.random((20, 6, 7))
+    model = MKSLocalizationModel(basis=PrimitiveBasis(2, [0, 1]), n_jobs=3)
+    model.fit(X, X)
+    n_jobs = []
+    numba_threads = filter_module.numba_threads
+
+    def _numba_threads(n_jobs_):
+        n_jobs.append(n_jobs_)
+        return numba_threads(n_jobs_)
+
+    monkeypatch.setattr(filter_module, 'numba_threads', _numba_threads)
+    model.predict(X)
+    assert n_jobs == [3]
+
+
 if __name__ == '__main__':
     test_MKS_elastic_delta()